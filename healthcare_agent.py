@@ -7,8 +7,9 @@ and maintains spreadsheets for HSA reconciliation and tax auditing.
 
 import os
 import json
+import threading
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import anyio
 
 from claude_agent_sdk import (
@@ -19,8 +20,8 @@ from claude_agent_sdk import (
     AssistantMessage,
     TextBlock,
 )
-from pdf_utils import extract_pdf_text, scan_for_pdfs
-from spreadsheet_manager import SpreadsheetManager
+from pdf_utils import extract_pdf_text, extract_pdfs_batch, parse_bill_fields, scan_for_pdfs
+from spreadsheet_manager import SpreadsheetManager, split_pdfs_by_hash
 
 
 # Optional: Load environment variables if you haven't authenticated Claude Code
@@ -31,30 +32,149 @@ except ImportError:
     pass  # dotenv not required if Claude Code is already authenticated
 
 
+# Tool bodies do blocking PDF and spreadsheet work, so they run in worker
+# threads via anyio.to_thread to keep the agent's event loop responsive.
+
+# Caps concurrent single-PDF parses; created lazily since it needs an event loop
+_pdf_limiter: Optional[anyio.CapacityLimiter] = None
+
+# Serializes access to the shared spreadsheet managers across worker threads
+_MANAGER_LOCK = threading.Lock()
+
+# Spreadsheet managers keyed by resolved workbook path, with the mtime of the
+# records file when it was loaded or last saved (None if it did not exist)
+_MANAGER_CACHE: Dict[str, Tuple[Optional[int], SpreadsheetManager]] = {}
+
+
+def _data_mtime(path: Path) -> Optional[int]:
+    """Return a file's modification time in nanoseconds, or None if missing."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _get_manager(workbook_path: str = "healthcare_bills.xlsx") -> SpreadsheetManager:
+    """
+    Return a shared SpreadsheetManager for the workbook.
+
+    The records are only re-read from disk when they have changed since
+    they were last loaded or saved by this process.
+    """
+    key = str(Path(workbook_path).expanduser().resolve())
+    mtime = _data_mtime(Path(key).with_suffix(".parquet"))
+
+    cached = _MANAGER_CACHE.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    manager = SpreadsheetManager(key)
+    _MANAGER_CACHE[key] = (mtime, manager)
+    return manager
+
+
+def _mark_manager_saved(manager: SpreadsheetManager) -> None:
+    """Record a manager's own save so the next lookup doesn't reload it."""
+    key = str(manager.workbook_path)
+    _MANAGER_CACHE[key] = (_data_mtime(manager.data_path), manager)
+
+
+def _invalidate_manager(workbook_path: str = "healthcare_bills.xlsx") -> None:
+    """Drop a cached manager so the next lookup reloads the records."""
+    _MANAGER_CACHE.pop(str(Path(workbook_path).expanduser().resolve()), None)
+
+
+def _get_pdf_limiter() -> anyio.CapacityLimiter:
+    """Return the limiter shared by all single-PDF extraction calls."""
+    global _pdf_limiter
+    if _pdf_limiter is None:
+        _pdf_limiter = anyio.CapacityLimiter(min(os.cpu_count() or 1, 8))
+    return _pdf_limiter
+
+
+async def _extract_text_in_thread(pdf_path: str) -> str:
+    """Extract PDF text in a worker thread, bounded by the shared PDF limiter."""
+    return await anyio.to_thread.run_sync(
+        extract_pdf_text, pdf_path, abandon_on_cancel=True, limiter=_get_pdf_limiter()
+    )
+
+
+def _add_bill(record: Dict[str, Any]) -> None:
+    """Add a bill record to the shared manager and save it."""
+    with _MANAGER_LOCK:
+        manager = _get_manager()
+        try:
+            manager.add_record(record)
+            manager.save()
+        except Exception:
+            # Don't keep an unsaved record around in the shared manager
+            _invalidate_manager()
+            raise
+        _mark_manager_saved(manager)
+
+
+def _scan_for_new_pdfs(directory: str, recursive: bool, dedup: bool) -> Dict[str, Any]:
+    """Scan for PDFs, optionally dropping those whose contents are already tracked."""
+    pdf_files = scan_for_pdfs(directory, recursive)
+    if not dedup:
+        return {"found": len(pdf_files), "files": pdf_files}
+
+    with _MANAGER_LOCK:
+        tracked = _get_manager().tracked_hashes()
+
+    # Hash the scanned files without holding the lock, so other tools aren't blocked
+    filtered = split_pdfs_by_hash(pdf_files, tracked)
+
+    return {
+        "found": len(filtered["new"]),
+        "already_tracked": len(filtered["already_tracked"]),
+        "duplicates": filtered["duplicates"],
+        "files": filtered["new"],
+    }
+
+
+def _get_summary() -> Dict[str, Any]:
+    """Summarize all tracked bills."""
+    with _MANAGER_LOCK:
+        return _get_manager().get_summary()
+
+
+def _export_spreadsheet(output_path: Optional[str]) -> str:
+    """Export all tracked bills to an Excel workbook."""
+    with _MANAGER_LOCK:
+        return _get_manager().export_excel(output_path)
+
+
+def _export_for_taxes(year: int, output_path: str) -> str:
+    """Export one year's bills for tax filing."""
+    with _MANAGER_LOCK:
+        return _get_manager().export_for_taxes(year, output_path)
+
+
 # Custom Tools
 @tool(
     "scan_pdfs",
-    "Scan a directory for PDF files and return their paths",
+    "Scan a directory for PDF files and return their paths, "
+    "skipping PDFs already in the spreadsheet unless dedup is false",
     {
         "directory": str,
         "recursive": bool,
+        "dedup": bool,
     }
 )
 async def scan_pdfs_tool(args: Dict[str, Any]) -> Dict[str, Any]:
     """Scan a directory for PDF files."""
     directory = args.get("directory", ".")
     recursive = args.get("recursive", True)
+    dedup = args.get("dedup", True)
 
     try:
-        pdf_files = scan_for_pdfs(directory, recursive)
+        result = await anyio.to_thread.run_sync(_scan_for_new_pdfs, directory, recursive, dedup)
         return {
             "content": [
                 {
                     "type": "text",
-                    "text": json.dumps({
-                        "found": len(pdf_files),
-                        "files": pdf_files
-                    }, indent=2)
+                    "text": json.dumps(result, indent=2)
                 }
             ]
         }
@@ -93,7 +213,7 @@ async def extract_pdf_content_tool(args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
     try:
-        text = extract_pdf_text(pdf_path)
+        text = await _extract_text_in_thread(pdf_path)
         return {
             "content": [
                 {
@@ -114,6 +234,107 @@ async def extract_pdf_content_tool(args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+@tool(
+    "extract_pdfs_batch",
+    "Extract text content from several PDF files at once, in parallel",
+    {
+        "type": "object",
+        "properties": {
+            "pdf_paths": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+        },
+        "required": ["pdf_paths"],
+    }
+)
+async def extract_pdfs_batch_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract text content from several PDF files in parallel."""
+    pdf_paths = args.get("pdf_paths")
+
+    if not pdf_paths:
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": "Error: pdf_paths is required"
+                }
+            ],
+            "isError": True
+        }
+
+    try:
+        # Run the extraction from a worker thread so the event loop stays responsive
+        results = await anyio.to_thread.run_sync(extract_pdfs_batch, list(pdf_paths))
+
+        content = []
+        for pdf_path, result in results.items():
+            if "text" in result:
+                text = f"Extracted content from {pdf_path}:\n\n{result['text']}"
+            else:
+                text = f"Error extracting PDF content from {pdf_path}: {result['error']}"
+            content.append({"type": "text", "text": text})
+
+        response: Dict[str, Any] = {"content": content}
+        if not any("text" in result for result in results.values()):
+            response["isError"] = True
+        return response
+    except Exception as e:
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Error extracting PDF content: {str(e)}"
+                }
+            ],
+            "isError": True
+        }
+
+
+@tool(
+    "parse_bill_fields",
+    "Extract likely provider, date and amount from a PDF bill without reading the full text",
+    {
+        "pdf_path": str,
+    }
+)
+async def parse_bill_fields_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract likely provider, date and amount from a PDF bill."""
+    pdf_path = args.get("pdf_path")
+
+    if not pdf_path:
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": "Error: pdf_path is required"
+                }
+            ],
+            "isError": True
+        }
+
+    try:
+        fields = parse_bill_fields(await _extract_text_in_thread(pdf_path))
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Parsed fields from {pdf_path}:\n{json.dumps(fields, indent=2)}"
+                }
+            ]
+        }
+    except Exception as e:
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Error parsing bill fields: {str(e)}"
+                }
+            ],
+            "isError": True
+        }
+
+
 @tool(
     "add_bill_to_spreadsheet",
     "Add a healthcare bill record to the tracking spreadsheet",
@@ -129,8 +350,6 @@ async def extract_pdf_content_tool(args: Dict[str, Any]) -> Dict[str, Any]:
 async def add_bill_to_spreadsheet_tool(args: Dict[str, Any]) -> Dict[str, Any]:
     """Add a healthcare bill to the tracking spreadsheet."""
     try:
-        manager = SpreadsheetManager()
-
         record = {
             "provider": args.get("provider", ""),
             "date": args.get("date", ""),
@@ -140,8 +359,7 @@ async def add_bill_to_spreadsheet_tool(args: Dict[str, Any]) -> Dict[str, Any]:
             "category": args.get("category", "medical"),
         }
 
-        manager.add_record(record)
-        manager.save()
+        await anyio.to_thread.run_sync(_add_bill, record)
 
         return {
             "content": [
@@ -171,8 +389,7 @@ async def add_bill_to_spreadsheet_tool(args: Dict[str, Any]) -> Dict[str, Any]:
 async def get_spreadsheet_summary_tool(args: Dict[str, Any]) -> Dict[str, Any]:
     """Get a summary of all tracked bills."""
     try:
-        manager = SpreadsheetManager()
-        summary = manager.get_summary()
+        summary = await anyio.to_thread.run_sync(_get_summary)
 
         return {
             "content": [
@@ -194,6 +411,38 @@ async def get_spreadsheet_summary_tool(args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+@tool(
+    "export_spreadsheet",
+    "Export all tracked healthcare bills to a formatted Excel workbook",
+    {
+        "output_path": str,
+    }
+)
+async def export_spreadsheet_tool(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Export all tracked bills to an Excel workbook."""
+    try:
+        output_path = await anyio.to_thread.run_sync(_export_spreadsheet, args.get("output_path"))
+
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Successfully exported all bill records to {output_path}"
+                }
+            ]
+        }
+    except Exception as e:
+        return {
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Error exporting spreadsheet: {str(e)}"
+                }
+            ],
+            "isError": True
+        }
+
+
 @tool(
     "export_for_taxes",
     "Export healthcare bills in a format suitable for tax filing",
@@ -205,11 +454,10 @@ async def get_spreadsheet_summary_tool(args: Dict[str, Any]) -> Dict[str, Any]:
 async def export_for_taxes_tool(args: Dict[str, Any]) -> Dict[str, Any]:
     """Export bills for tax purposes."""
     try:
-        manager = SpreadsheetManager()
         year = args.get("year")
         output_path = args.get("output_path", f"tax_export_{year}.xlsx")
 
-        manager.export_for_taxes(year, output_path)
+        await anyio.to_thread.run_sync(_export_for_taxes, year, output_path)
 
         return {
             "content": [
@@ -238,8 +486,11 @@ healthcare_server = create_sdk_mcp_server(
     tools=[
         scan_pdfs_tool,
         extract_pdf_content_tool,
+        extract_pdfs_batch_tool,
+        parse_bill_fields_tool,
         add_bill_to_spreadsheet_tool,
         get_spreadsheet_summary_tool,
+        export_spreadsheet_tool,
         export_for_taxes_tool,
     ]
 )
@@ -254,8 +505,11 @@ async def run_agent(initial_prompt: str = None):
         allowed_tools=[
             "mcp__healthcare__scan_pdfs",
             "mcp__healthcare__extract_pdf_content",
+            "mcp__healthcare__extract_pdfs_batch",
+            "mcp__healthcare__parse_bill_fields",
             "mcp__healthcare__add_bill_to_spreadsheet",
             "mcp__healthcare__get_spreadsheet_summary",
+            "mcp__healthcare__export_spreadsheet",
             "mcp__healthcare__export_for_taxes",
         ],
         system_prompt="""You are a healthcare bill processing assistant. Your job is to:
@@ -265,6 +519,9 @@ async def run_agent(initial_prompt: str = None):
 4. Help with HSA reconciliation and tax preparation
 
 When processing bills:
+- Use extract_pdfs_batch to read several PDFs at once instead of one at a time
+- Use parse_bill_fields for a quick first guess at provider, date and amount,
+  and check the full text when the guess looks wrong or incomplete
 - Look for provider/facility names
 - Extract dates in various formats
 - Find amounts (look for "Amount Due", "Total", "Balance", etc.)
@@ -4,16 +4,44 @@ PDF Utilities for Healthcare Bill Processing
 Provides functions to scan for PDFs and extract text content.
 """
 
+import atexit
+import hashlib
+import multiprocessing
 import os
+import re
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List
-import pdfplumber
-import PyPDF2
+from typing import Any, Dict, List, Optional
+
+# The PDF libraries are imported where they are used, so scanning for PDFs
+# and importing this module stay fast
+
+
+# PDFium is not thread-safe, even across separate documents, so every
+# pypdfium2 call in this process runs under this lock
+_PDFIUM_LOCK = threading.Lock()
+
+# On-disk cache of extracted PDF text, keyed by path, modification time and size
+PDF_TEXT_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "hsa_agent" / "pdf_text"
+)
+
+# Patterns for pulling common fields out of extracted bill text
+_DATE_RE = re.compile(r"\b(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})\b")
+_PROVIDER_RE = re.compile(r"^\s*([A-Z][A-Za-z0-9&,\.\- ]{3,60})\s*$", re.MULTILINE)
+
+# Lowercase labels that precede an amount on a bill ("amount" must be followed by "due")
+_AMOUNT_KEYWORDS = ("amount", "total", "balance")
+_DIGITS = frozenset("0123456789")
 
 
 def scan_for_pdfs(directory: str, recursive: bool = True) -> List[str]:
     """
-    Scan a directory for PDF files.
+    Scan a directory for PDF files (matching the .pdf extension in any case).
 
     Args:
         directory: Path to the directory to scan
@@ -31,14 +59,22 @@ def scan_for_pdfs(directory: str, recursive: bool = True) -> List[str]:
     if not directory_path.is_dir():
         raise ValueError(f"Path is not a directory: {directory}")
 
-    if recursive:
-        # Recursively find all PDF files
-        for pdf_file in directory_path.rglob("*.pdf"):
-            pdf_files.append(str(pdf_file))
-    else:
-        # Only scan the immediate directory
-        for pdf_file in directory_path.glob("*.pdf"):
-            pdf_files.append(str(pdf_file))
+    # Walk the tree with os.scandir, whose entries carry the file type from the
+    # directory listing, so no extra stat() or Path object is needed per entry
+    pending_dirs = deque([str(directory_path)])
+    while pending_dirs:
+        current_dir = pending_dirs.popleft()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending_dirs.append(entry.path)
+                    elif entry.name[-4:].lower() == ".pdf" and entry.is_file():
+                        pdf_files.append(entry.path)
+        except PermissionError:
+            # Skip unreadable directories rather than failing the whole scan
+            continue
 
     # Sort for consistent ordering
     pdf_files.sort()
@@ -50,7 +86,12 @@ def extract_pdf_text(pdf_path: str) -> str:
     """
     Extract text content from a PDF file.
 
-    Uses pdfplumber as the primary method, with PyPDF2 as a fallback.
+    Uses pypdfium2 as the primary method, since its C++ PDFium engine is much
+    faster than the pure-Python parsers. Falls back to pdfplumber (better for
+    complex layouts) when pypdfium2 fails or finds no text, then to PyPDF2.
+
+    Extracted text is cached in memory and on disk, so repeat calls on an
+    unchanged file skip parsing entirely.
 
     Args:
         pdf_path: Path to the PDF file
@@ -70,39 +111,366 @@ def extract_pdf_text(pdf_path: str) -> str:
     if pdf_path.suffix.lower() != ".pdf":
         raise ValueError(f"File is not a PDF: {pdf_path}")
 
-    text = ""
+    stat = os.stat(pdf_path)
+    return _cached_extract(str(pdf_path), stat.st_mtime_ns, stat.st_size)
 
-    # Try pdfplumber first (better for complex layouts)
+
+@lru_cache(maxsize=128)
+def _cached_extract(path_str: str, mtime_ns: int, size: int) -> str:
+    """Extract text for one version of a PDF, checking the on-disk cache first."""
+    cache_file = _cache_file_for(path_str, mtime_ns, size)
     try:
+        return cache_file.read_text(encoding="utf-8")
+    except OSError:
+        pass
+
+    text = _extract_text_uncached(Path(path_str))
+    _write_cache_file(cache_file, text)
+
+    return text
+
+
+# Lets callers (and tests) drop the in-memory cache without touching the disk cache.
+# mypy doesn't allow new attributes on a plain function, hence the ignore.
+extract_pdf_text.cache_clear = _cached_extract.cache_clear  # type: ignore[attr-defined]
+
+
+def _extract_text_uncached(pdf_path: Path) -> str:
+    """Run the pypdfium2 -> pdfplumber -> PyPDF2 extraction chain on a PDF."""
+    # Collect page headers and text in a list and join once at the end
+    parts: List[str] = []
+    pdfium_error = None
+
+    # Try pypdfium2 first (fastest for plain text)
+    try:
+        import pypdfium2 as pdfium
+
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(str(pdf_path))
+            try:
+                for page_num, page in enumerate(pdf, 1):
+                    textpage = page.get_textpage()
+                    # PDFium separates lines with CRLF
+                    page_text = textpage.get_text_range().replace("\r\n", "\n")
+                    textpage.close()
+                    page.close()
+                    if page_text.strip():
+                        parts.extend((f"\n--- Page {page_num} ---\n", page_text, "\n"))
+            finally:
+                pdf.close()
+    except Exception as e:
+        pdfium_error = e
+        parts.clear()
+
+    text = "".join(parts).strip()
+    if text:
+        return text
+
+    # Fall back to pdfplumber (better for complex layouts)
+    try:
+        import pdfplumber
+
         with pdfplumber.open(pdf_path) as pdf:
             for page_num, page in enumerate(pdf.pages, 1):
                 page_text = page.extract_text()
                 if page_text:
-                    text += f"\n--- Page {page_num} ---\n"
-                    text += page_text
-                    text += "\n"
+                    parts.extend((f"\n--- Page {page_num} ---\n", page_text, "\n"))
     except Exception as e:
-        # Fallback to PyPDF2
+        # Fallback to PyPDF2, dropping any pages pdfplumber got before failing
+        parts.clear()
         try:
+            import PyPDF2
+
             with open(pdf_path, "rb") as file:
                 reader = PyPDF2.PdfReader(file)
                 for page_num, page in enumerate(reader.pages, 1):
                     page_text = page.extract_text()
                     if page_text:
-                        text += f"\n--- Page {page_num} ---\n"
-                        text += page_text
-                        text += "\n"
+                        parts.extend((f"\n--- Page {page_num} ---\n", page_text, "\n"))
         except Exception as fallback_error:
             raise Exception(
-                f"Failed to extract text using both methods. "
+                f"Failed to extract text using all methods. "
+                f"pypdfium2 error: {str(pdfium_error or 'no text found')}, "
                 f"pdfplumber error: {str(e)}, "
                 f"PyPDF2 error: {str(fallback_error)}"
             )
 
-    if not text.strip():
+    text = "".join(parts).strip()
+    if not text:
         raise Exception("No text could be extracted from the PDF. The PDF might be image-based or encrypted.")
 
-    return text.strip()
+    return text
+
+
+def _cache_file_for(path_str: str, mtime_ns: int, size: int) -> Path:
+    """Return the cache file for a PDF, keyed by its path, mtime and size."""
+    key = hashlib.blake2b(f"{path_str}:{mtime_ns}:{size}".encode(), digest_size=16).hexdigest()
+    return PDF_TEXT_CACHE_DIR / f"{key}.txt"
+
+
+def _write_cache_file(cache_file: Path, text: str) -> None:
+    """Atomically write extracted text to the cache, ignoring any I/O errors."""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, cache_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # A read-only or full cache directory must not break extraction
+        pass
+
+
+def clear_cache() -> int:
+    """
+    Remove all cached PDF text, both in memory and on disk.
+
+    Returns:
+        Number of cache files removed
+    """
+    _cached_extract.cache_clear()
+
+    removed = 0
+    if not PDF_TEXT_CACHE_DIR.is_dir():
+        return removed
+
+    # Include temp files left behind by writes that were interrupted
+    for cache_file in [*PDF_TEXT_CACHE_DIR.glob("*.txt"), *PDF_TEXT_CACHE_DIR.glob("*.tmp")]:
+        try:
+            cache_file.unlink()
+            removed += 1
+        except OSError:
+            pass
+
+    return removed
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Compute the SHA-256 hash of a file's contents.
+
+    Used to recognize the same bill under a different name or location.
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(Path(file_path).expanduser(), "rb") as file:
+        # Read in 1 MiB chunks so large files aren't loaded into memory at once
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _extract_pdf_text_or_error(pdf_path: str) -> Dict[str, str]:
+    """Extract text from a PDF, returning {"text": ...} or {"error": ...} instead of raising."""
+    try:
+        return {"text": extract_pdf_text(pdf_path)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def _has_cached_text(pdf_path: str) -> bool:
+    """Check whether a PDF's text is already in the on-disk cache."""
+    try:
+        resolved = Path(pdf_path).expanduser().resolve()
+        stat = resolved.stat()
+    except OSError:
+        return False
+    return _cache_file_for(str(resolved), stat.st_mtime_ns, stat.st_size).exists()
+
+
+# Worker processes for extract_pdfs_batch, created on first use and reused so
+# each batch doesn't pay for starting (and importing into) fresh processes
+_batch_pool: Optional[ProcessPoolExecutor] = None
+_batch_pool_workers = 0
+_BATCH_POOL_LOCK = threading.Lock()
+
+
+def _get_batch_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the shared worker pool, recreating it if the worker count changed."""
+    global _batch_pool, _batch_pool_workers
+    with _BATCH_POOL_LOCK:
+        if _batch_pool is None or _batch_pool_workers != max_workers:
+            if _batch_pool is not None:
+                _batch_pool.shutdown(wait=False)
+            # Spawn rather than fork: this is usually called from a worker thread, and
+            # forking a multi-threaded process can hand the child a lock held by another thread
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _batch_pool_workers = max_workers
+        return _batch_pool
+
+
+def _shutdown_batch_pool() -> None:
+    """Stop the shared worker pool, if one was started."""
+    global _batch_pool
+    with _BATCH_POOL_LOCK:
+        if _batch_pool is not None:
+            _batch_pool.shutdown(wait=False, cancel_futures=True)
+            _batch_pool = None
+
+
+atexit.register(_shutdown_batch_pool)
+
+
+def extract_pdfs_batch(
+    pdf_paths: List[str], max_workers: Optional[int] = None
+) -> Dict[str, Dict[str, str]]:
+    """
+    Extract text content from several PDF files, parsing uncached ones in parallel.
+
+    PDFs whose text is already cached are served in this process. The rest
+    are parsed in a shared pool of worker processes, since text extraction is
+    CPU-bound and does not benefit from threads; a single uncached PDF is
+    parsed here directly, as starting a worker would cost more than it saves.
+    A failure on one PDF does not affect the others.
+
+    Args:
+        pdf_paths: Paths to the PDF files
+        max_workers: Number of worker processes (default: CPU count, capped at 8)
+
+    Returns:
+        Dictionary mapping each PDF path to {"text": ...} on success or
+        {"error": ...} on failure
+    """
+    results: Dict[str, Dict[str, str]] = {}
+    misses = []
+    for pdf_path in pdf_paths:
+        if _has_cached_text(pdf_path):
+            results[pdf_path] = _extract_pdf_text_or_error(pdf_path)
+        else:
+            misses.append(pdf_path)
+
+    if len(misses) <= 1:
+        for pdf_path in misses:
+            results[pdf_path] = _extract_pdf_text_or_error(pdf_path)
+    else:
+        if max_workers is None:
+            max_workers = min(os.cpu_count() or 1, 8)
+        max_workers = max(1, max_workers)
+
+        # Batch small groups of files per task, but keep every worker busy on short lists
+        chunksize = max(1, min(4, len(misses) // max_workers))
+
+        pool = _get_batch_pool(max_workers)
+        parsed = pool.map(_extract_pdf_text_or_error, misses, chunksize=chunksize)
+        for pdf_path, result in zip(misses, parsed):
+            # Workers wrote the disk cache; reading it back here also fills the
+            # in-memory cache for later single-file calls
+            if "text" in result and _has_cached_text(pdf_path):
+                result = _extract_pdf_text_or_error(pdf_path)
+            results[pdf_path] = result
+
+    # Keep the caller's order
+    return {pdf_path: results[pdf_path] for pdf_path in pdf_paths}
+
+
+def find_amounts(text: str) -> List[float]:
+    """
+    Find amounts that follow an "Amount Due", "Total" or "Balance" label.
+
+    Matches labels case-insensitively, skips any whitespace, colons and
+    dollar signs after the label, then reads a number with exactly two
+    decimal places (e.g. "Total: $1,450.00"). This is a single hand-written
+    pass over the text rather than a regular expression, since it runs on
+    every page of every bill.
+
+    Args:
+        text: Text extracted from a bill PDF
+
+    Returns:
+        Amounts in the order they appear in the text
+    """
+    # Lowercasing only changes letters, so digits and punctuation keep their positions
+    text = text.lower()
+    n = len(text)
+    amounts = []
+    i = 0
+
+    while True:
+        # Find the earliest label at or after i
+        start = -1
+        j = -1
+        for keyword in _AMOUNT_KEYWORDS:
+            pos = text.find(keyword, i)
+            if pos != -1 and (start == -1 or pos < start):
+                start = pos
+                j = pos + len(keyword)
+
+        if start == -1:
+            break
+
+        # "amount" only counts as a label when followed by whitespace and "due"
+        if text.startswith("amount", start):
+            k = j
+            while k < n and text[k].isspace():
+                k += 1
+            if k == j or not text.startswith("due", k):
+                i = start + 1
+                continue
+            j = k + 3
+
+        # Skip separators between the label and the number
+        while j < n and (text[j].isspace() or text[j] in ":$"):
+            j += 1
+
+        # Integer part with thousands separators, then exactly ".dd"
+        k = j
+        while k < n and (text[k] in _DIGITS or text[k] == ","):
+            k += 1
+
+        # Require at least one digit before the decimal point. Comma-only runs such
+        # as "Total ,.95" are ignored on purpose rather than read as 0.95.
+        number = text[j:k].replace(",", "")
+        if (
+            number
+            and k + 2 < n
+            and text[k] == "."
+            and text[k + 1] in _DIGITS
+            and text[k + 2] in _DIGITS
+        ):
+            amounts.append(float(number + text[k:k + 3]))
+            i = k + 3
+        else:
+            i = start + 1
+
+    return amounts
+
+
+def parse_bill_fields(text: str) -> Dict[str, Any]:
+    """
+    Pull provider, date and amount candidates out of extracted bill text.
+
+    This is a quick heuristic pass; the first candidate of each kind is
+    reported as the best guess, with all candidates included for review.
+
+    Args:
+        text: Text extracted from a bill PDF
+
+    Returns:
+        Dictionary with provider, date and amount guesses plus all
+        date and amount candidates found
+    """
+    amounts = find_amounts(text)
+    dates = [m.group(1) for m in _DATE_RE.finditer(text)]
+    provider_match = _PROVIDER_RE.search(text)
+
+    return {
+        "provider": provider_match.group(1).strip() if provider_match else None,
+        "date": dates[0] if dates else None,
+        "amount": amounts[0] if amounts else None,
+        "date_candidates": dates,
+        "amount_candidates": amounts,
+    }
 
 
 def extract_pdf_metadata(pdf_path: str) -> dict:
@@ -127,17 +495,24 @@ def extract_pdf_metadata(pdf_path: str) -> dict:
     }
 
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            metadata["num_pages"] = len(reader.pages)
-
-            if reader.metadata:
-                metadata["title"] = reader.metadata.get("/Title", "")
-                metadata["author"] = reader.metadata.get("/Author", "")
-                metadata["subject"] = reader.metadata.get("/Subject", "")
-                metadata["creator"] = reader.metadata.get("/Creator", "")
-                metadata["producer"] = reader.metadata.get("/Producer", "")
-                metadata["creation_date"] = reader.metadata.get("/CreationDate", "")
+        import pypdfium2 as pdfium
+
+        # PDFium reads the page count and Info dictionary without parsing page content
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(str(pdf_path))
+            try:
+                metadata["num_pages"] = len(pdf)
+                info = pdf.get_metadata_dict(skip_empty=True)
+            finally:
+                pdf.close()
+
+        if info:
+            metadata["title"] = info.get("Title", "")
+            metadata["author"] = info.get("Author", "")
+            metadata["subject"] = info.get("Subject", "")
+            metadata["creator"] = info.get("Creator", "")
+            metadata["producer"] = info.get("Producer", "")
+            metadata["creation_date"] = info.get("CreationDate", "")
 
     except Exception as e:
         metadata["error"] = f"Failed to extract metadata: {str(e)}"
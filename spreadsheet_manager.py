@@ -2,16 +2,79 @@
 Spreadsheet Manager for Healthcare Bill Tracking
 
 Manages Excel spreadsheets for HSA reconciliation and tax auditing.
+Records are stored in a Parquet file; Excel workbooks are generated on demand.
 """
 
+import calendar
+import json
 import os
+import tempfile
+from functools import cached_property
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Any, Optional
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils.dataframe import dataframe_to_rows
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Set
+
+from pdf_utils import file_hash
+
+# pandas is imported where it is used, so loading this module stays fast
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Leading magic bytes and smallest possible size of each file format, checked
+# before handing a file to its (much slower) parser
+_XLSX_MAGIC = b"PK\x03\x04"
+_XLSX_MIN_SIZE = 22  # an empty ZIP archive
+_PARQUET_MAGIC = b"PAR1"
+_PARQUET_MIN_SIZE = 12  # header magic, footer length and footer magic
+
+
+def _looks_like(path: Path, magic: bytes, min_size: int) -> bool:
+    """Check a file's size and leading bytes without parsing it."""
+    try:
+        if path.stat().st_size < min_size:
+            return False
+        with open(path, "rb") as file:
+            return file.read(len(magic)) == magic
+    except OSError:
+        return False
+
+
+def split_pdfs_by_hash(pdf_paths: List[str], tracked_hashes: Set[str]) -> Dict[str, List[str]]:
+    """
+    Sort PDFs into untracked, already tracked and repeated within pdf_paths.
+
+    Files are compared by content hash, so a renamed or moved copy of a
+    tracked bill counts as already tracked.
+
+    Args:
+        pdf_paths: Paths to PDF files
+        tracked_hashes: Content hashes of the PDFs already tracked
+
+    Returns:
+        Dictionary with, in their original order:
+            new: Paths whose contents are not yet tracked (first copy only)
+            already_tracked: Paths whose contents are already tracked
+            duplicates: Later copies of a file listed under new
+    """
+    result: Dict[str, List[str]] = {"new": [], "already_tracked": [], "duplicates": []}
+    seen: Set[str] = set()
+    for pdf_path in pdf_paths:
+        try:
+            content_hash = file_hash(pdf_path)
+        except OSError:
+            # Keep unreadable files so extraction can report the problem
+            result["new"].append(pdf_path)
+            continue
+
+        if content_hash in tracked_hashes:
+            result["already_tracked"].append(pdf_path)
+        elif content_hash in seen:
+            result["duplicates"].append(pdf_path)
+        else:
+            seen.add(content_hash)
+            result["new"].append(pdf_path)
+
+    return result
 
 
 class SpreadsheetManager:
@@ -22,14 +85,40 @@ class SpreadsheetManager:
         Initialize the spreadsheet manager.
 
         Args:
-            workbook_path: Path to the Excel workbook file
+            workbook_path: Path to the Excel workbook file. Records are stored
+                next to it in a Parquet file with the same name.
         """
         self.workbook_path = Path(workbook_path).expanduser().resolve()
+        self.data_path = self.workbook_path.with_suffix(".parquet")
+        # Bills sheet column widths from the last export, reused while the
+        # columns and row count are unchanged; also kept in a sidecar file
+        self.widths_path = self.workbook_path.with_suffix(".widths.json")
+        self._widths_fp: Optional[List[Any]] = None
+        self._widths: Dict[str, int] = {}
         self.df = self._load_or_create_dataframe()
-
-    def _load_or_create_dataframe(self) -> pd.DataFrame:
-        """Load existing spreadsheet or create a new one."""
-        if self.workbook_path.exists():
+        # Rows added since the last flush; appended to self.df in one go
+        self._pending: List[Dict[str, Any]] = []
+        # Whether hashes for records saved without one have been filled in
+        self._hashes_backfilled = False
+
+    def _load_or_create_dataframe(self) -> "pd.DataFrame":
+        """Load existing records or create a new dataframe."""
+        import pandas as pd
+
+        if self.data_path.exists():
+            if not _looks_like(self.data_path, _PARQUET_MAGIC, _PARQUET_MIN_SIZE):
+                print(f"Warning: Ignoring empty or invalid file: {self.data_path}")
+                return self._create_empty_dataframe()
+            try:
+                return pd.read_parquet(self.data_path)
+            except Exception as e:
+                print(f"Warning: Could not load existing file: {e}")
+                return self._create_empty_dataframe()
+        elif self.workbook_path.exists():
+            # Records from before the Parquet store; migrated on the next save
+            if not _looks_like(self.workbook_path, _XLSX_MAGIC, _XLSX_MIN_SIZE):
+                print(f"Warning: Ignoring empty or invalid file: {self.workbook_path}")
+                return self._create_empty_dataframe()
             try:
                 df = pd.read_excel(self.workbook_path, sheet_name="Bills")
                 # Ensure date column is datetime
@@ -42,8 +131,10 @@ class SpreadsheetManager:
         else:
             return self._create_empty_dataframe()
 
-    def _create_empty_dataframe(self) -> pd.DataFrame:
+    def _create_empty_dataframe(self) -> "pd.DataFrame":
         """Create an empty dataframe with the required columns."""
+        import pandas as pd
+
         return pd.DataFrame(columns=[
             "date",
             "provider",
@@ -54,6 +145,7 @@ class SpreadsheetManager:
             "year",
             "month",
             "added_on",
+            "hash",
         ])
 
     def add_record(self, record: Dict[str, Any]) -> None:
@@ -63,8 +155,11 @@ class SpreadsheetManager:
         Args:
             record: Dictionary containing bill information
                 Required keys: provider, date, amount
-                Optional keys: category, description, pdf_path
+                Optional keys: category, description, pdf_path, hash
+                (hash is computed from pdf_path when not given)
         """
+        import pandas as pd
+
         # Parse date
         date_str = record.get("date", "")
         try:
@@ -72,6 +167,15 @@ class SpreadsheetManager:
         except Exception:
             date = pd.Timestamp.now()
 
+        # Content hash of the source PDF, used to skip it on later scans
+        pdf_path = record.get("pdf_path", "")
+        content_hash = record.get("hash", "")
+        if not content_hash and pdf_path:
+            try:
+                content_hash = file_hash(pdf_path)
+            except OSError:
+                content_hash = ""
+
         # Create new row
         new_row = {
             "date": date,
@@ -83,10 +187,96 @@ class SpreadsheetManager:
             "year": date.year,
             "month": date.month,
             "added_on": pd.Timestamp.now(),
+            "hash": content_hash,
         }
 
-        # Add to dataframe
-        self.df = pd.concat([self.df, pd.DataFrame([new_row])], ignore_index=True)
+        # Queue the row; it is added to the dataframe on the next flush
+        self._pending.append(new_row)
+
+    def _flush(self) -> None:
+        """Append any pending records to the dataframe."""
+        import pandas as pd
+
+        if not self._pending:
+            return
+
+        pending_df = pd.DataFrame(self._pending)
+        if self.df.empty:
+            self.df = pending_df
+        else:
+            self.df = pd.concat([self.df, pending_df], ignore_index=True)
+        self._pending.clear()
+
+        # The data changed, so cached summaries are stale
+        self.__dict__.pop("_all_summaries", None)
+
+    @cached_property
+    def _all_summaries(self) -> Dict[str, "pd.DataFrame"]:
+        """
+        Amount totals and bill counts by year, category and provider.
+
+        Groups the full dataframe once by all three keys, then derives each
+        per-key summary from that much smaller result. Cached until the next
+        flush changes the data.
+        """
+        combined = self.df.groupby(["year", "category", "provider"], dropna=False).agg(
+            amount=("amount", "sum"),
+            num_bills=("amount", "size"),
+        )
+
+        return {
+            key: combined.groupby(level=key).sum()
+            for key in ("year", "category", "provider")
+        }
+
+    def tracked_hashes(self) -> Set[str]:
+        """
+        Return the content hashes of all tracked PDFs.
+
+        The first call also fills in hashes for records saved before hashes
+        were tracked, using their pdf_path where the file still exists.
+
+        Returns:
+            Set of SHA-256 hex digests
+        """
+        self._flush()
+
+        if not self._hashes_backfilled:
+            self._backfill_hashes()
+            self._hashes_backfilled = True
+
+        return {h for h in self.df["hash"].dropna() if h}
+
+    def _backfill_hashes(self) -> None:
+        """Hash the source PDFs of records that have a pdf_path but no hash."""
+        if "hash" not in self.df.columns:
+            self.df["hash"] = ""
+
+        missing = self.df["hash"].isna() | (self.df["hash"] == "")
+        if not missing.any():
+            return
+
+        hashes_by_path: Dict[str, str] = {}
+
+        def hash_or_empty(pdf_path: Any) -> str:
+            if not isinstance(pdf_path, str) or not pdf_path:
+                return ""
+            if pdf_path not in hashes_by_path:
+                try:
+                    hashes_by_path[pdf_path] = file_hash(pdf_path)
+                except OSError:
+                    hashes_by_path[pdf_path] = ""
+            return hashes_by_path[pdf_path]
+
+        self.df.loc[missing, "hash"] = self.df.loc[missing, "pdf_path"].map(hash_or_empty)
+
+    def filter_new_pdfs(self, pdf_paths: List[str]) -> Dict[str, List[str]]:
+        """
+        Sort PDFs into untracked, already tracked and repeated within pdf_paths.
+
+        See split_pdfs_by_hash; this uses the manager's tracked hashes.
+        """
+        return split_pdfs_by_hash(pdf_paths, self.tracked_hashes())
 
     def get_summary(self) -> Dict[str, Any]:
         """
@@ -95,6 +285,8 @@ class SpreadsheetManager:
         Returns:
             Dictionary containing summary statistics
         """
+        self._flush()
+
         if self.df.empty:
             return {
                 "total_records": 0,
@@ -109,87 +301,161 @@ class SpreadsheetManager:
                 "earliest": str(self.df["date"].min()),
                 "latest": str(self.df["date"].max()),
             },
-            "by_category": self.df.groupby("category")["amount"].sum().to_dict(),
-            "by_year": self.df.groupby("year")["amount"].sum().to_dict(),
-            "by_provider": self.df.groupby("provider")["amount"].sum().to_dict(),
+            "by_category": self._totals_by("category")["amount"].to_dict(),
+            "by_year": self._totals_by("year")["amount"].to_dict(),
+            "by_provider": self._totals_by("provider")["amount"].to_dict(),
         }
 
         return summary
 
     def save(self) -> None:
-        """Save the dataframe to the Excel workbook with formatting."""
+        """Save the records to the Parquet data file."""
+        self._flush()
+
         if self.df.empty:
             print("Warning: No data to save")
             return
 
         # Sort by date
-        self.df = self.df.sort_values("date", ascending=False)
+        self.df = self.df.sort_values("date", ascending=False, ignore_index=True)
+
+        # Write to a temp file and swap it in, so a crash mid-write can't leave a
+        # truncated file in place of the only copy of the records
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.data_path.parent, prefix=f".{self.data_path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                self.df.to_parquet(file, engine="pyarrow", compression="zstd", index=False)
+            os.replace(tmp_path, self.data_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        print(f"Saved to {self.data_path}")
+
+    def export_excel(self, output_path: Optional[str] = None) -> str:
+        """
+        Export all records to a formatted Excel workbook with summary sheets.
+
+        Args:
+            output_path: Output file path (default: the manager's workbook path)
+
+        Returns:
+            Path to the exported file
+        """
+        import pandas as pd
+
+        self._flush()
+
+        if self.df.empty:
+            raise ValueError("No records found")
+
+        if output_path is None:
+            export_path = self.workbook_path
+        else:
+            export_path = Path(output_path).expanduser().resolve()
+
+        # Sort by date
+        bills_df = self.df.sort_values("date", ascending=False)
 
         # Create Excel writer
-        with pd.ExcelWriter(self.workbook_path, engine="openpyxl") as writer:
+        with pd.ExcelWriter(export_path, engine="xlsxwriter") as writer:
             # Write main bills sheet
-            self.df.to_excel(writer, sheet_name="Bills", index=False)
+            bills_df.to_excel(writer, sheet_name="Bills", index=False)
 
             # Write summary sheets
             self._write_summary_sheets(writer)
 
             # Format the workbook
-            workbook = writer.book
-            self._format_bills_sheet(workbook["Bills"])
+            widths = self._cached_column_widths(bills_df)
+            self._format_bills_sheet(writer.book, writer.sheets["Bills"], widths)
 
-        print(f"Saved to {self.workbook_path}")
+        print(f"Exported to {export_path}")
+        return str(export_path)
 
-    def _write_summary_sheets(self, writer: pd.ExcelWriter) -> None:
+    def _write_summary_sheets(self, writer: "pd.ExcelWriter") -> None:
         """Write summary sheets to the workbook."""
         if self.df.empty:
             return
 
         # By year
-        year_summary = self.df.groupby("year").agg({
-            "amount": "sum",
-            "provider": "count"
-        }).rename(columns={"provider": "num_bills"})
+        year_summary = self._totals_by("year")
         year_summary.to_excel(writer, sheet_name="By Year")
 
         # By category
-        category_summary = self.df.groupby("category").agg({
-            "amount": "sum",
-            "provider": "count"
-        }).rename(columns={"provider": "num_bills"})
+        category_summary = self._totals_by("category")
         category_summary.to_excel(writer, sheet_name="By Category")
 
         # By provider
-        provider_summary = self.df.groupby("provider").agg({
-            "amount": "sum",
-            "date": "count"
-        }).rename(columns={"date": "num_bills"}).sort_values("amount", ascending=False)
+        provider_summary = self._totals_by("provider").sort_values("amount", ascending=False)
         provider_summary.to_excel(writer, sheet_name="By Provider")
 
-    def _format_bills_sheet(self, worksheet) -> None:
-        """Apply formatting to the Bills sheet."""
-        # Header formatting
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True)
+    def _totals_by(self, key: str) -> "pd.DataFrame":
+        """Total amount and number of bills per year, category or provider."""
+        return self._all_summaries[key]
 
-        for cell in worksheet[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+    def _cached_column_widths(self, df: "pd.DataFrame") -> Dict[str, int]:
+        """Return column widths, recomputing only when the shape of df has changed."""
+        fingerprint = [[str(column) for column in df.columns], len(df)]
+        if fingerprint == self._widths_fp:
+            return self._widths
 
-        # Auto-adjust column widths
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
+        # Reuse widths saved by an earlier run for the same shape
+        try:
+            saved = json.loads(self.widths_path.read_text())
+            if saved.get("fingerprint") == fingerprint:
+                self._widths_fp = fingerprint
+                self._widths = saved["widths"]
+                return self._widths
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
 
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
+        self._widths = self._column_widths(df)
+        self._widths_fp = fingerprint
 
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
+        try:
+            self.widths_path.write_text(
+                json.dumps({"fingerprint": fingerprint, "widths": self._widths})
+            )
+        except OSError:
+            # The widths are only a formatting shortcut; failing to save them is harmless
+            pass
+
+        return self._widths
+
+    def _column_widths(self, df: "pd.DataFrame") -> Dict[str, int]:
+        """Compute Excel column widths from the longest value in each column."""
+        import pandas as pd
+
+        widths = {}
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                # Datetimes are written in the writer's "YYYY-MM-DD HH:MM:SS" format
+                longest = len("YYYY-MM-DD HH:MM:SS")
+            else:
+                # Missing values are written as blank cells, so they don't count
+                max_length = series.dropna().astype(str).str.len().max()
+                longest = 0 if pd.isna(max_length) else int(max_length)
+            widths[column] = min(max(len(str(column)), longest) + 2, 50)
+        return widths
+
+    def _format_bills_sheet(self, workbook, worksheet, widths: Dict[str, int]) -> None:
+        """Apply formatting to the Bills sheet."""
+        # Header formatting
+        header_format = workbook.add_format({
+            "bg_color": "#4472C4",
+            "font_color": "white",
+            "bold": True,
+            "align": "center",
+            "valign": "vcenter",
+        })
+
+        for col_num, column in enumerate(self.df.columns):
+            # Rewrite the header cell with our format
+            worksheet.write(0, col_num, column, header_format)
+            worksheet.set_column(col_num, col_num, widths[column])
 
     def export_for_taxes(self, year: int, output_path: str = None) -> str:
         """
@@ -202,13 +468,17 @@ class SpreadsheetManager:
         Returns:
             Path to the exported file
         """
+        import pandas as pd
+
+        self._flush()
+
         if output_path is None:
             output_path = f"tax_export_{year}.xlsx"
 
         output_path = Path(output_path).expanduser().resolve()
 
         # Filter by year
-        year_df = self.df[self.df["year"] == year].copy()
+        year_df = self.df[self.df["year"] == year]
 
         if year_df.empty:
             raise ValueError(f"No records found for year {year}")
@@ -220,7 +490,7 @@ class SpreadsheetManager:
         total_amount = year_df["amount"].sum()
 
         # Create tax export with summary
-        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
             # Detail sheet
             year_df[["date", "provider", "category", "amount", "description"]].to_excel(
                 writer, sheet_name="Details", index=False
@@ -231,10 +501,11 @@ class SpreadsheetManager:
             category_summary.columns = ["Category", "Total Amount"]
             category_summary.to_excel(writer, sheet_name="Category Summary", index=False)
 
-            # Monthly summary
-            year_df["month_name"] = pd.to_datetime(year_df["date"]).dt.strftime("%B")
-            monthly_summary = year_df.groupby(["month", "month_name"])["amount"].sum().reset_index()
-            monthly_summary = monthly_summary.sort_values("month")
+            # Monthly summary, grouped on the month number and named afterwards
+            monthly_summary = year_df.groupby("month", sort=True)["amount"].sum().reset_index()
+            monthly_summary["month_name"] = [
+                calendar.month_name[int(month)] for month in monthly_summary["month"]
+            ]
             monthly_summary[["month_name", "amount"]].to_excel(
                 writer, sheet_name="Monthly Summary", index=False
             )
@@ -265,6 +536,10 @@ class SpreadsheetManager:
         Returns:
             Path to the exported file
         """
+        import pandas as pd
+
+        self._flush()
+
         if output_path is None:
             output_path = "hsa_reconciliation.xlsx"
 
@@ -282,7 +557,7 @@ class SpreadsheetManager:
         # Sort by date
         hsa_df = hsa_df.sort_values("date")
 
-        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
             # Main HSA sheet
             hsa_df[["date", "provider", "category", "amount", "description", "pdf_path"]].to_excel(
                 writer, sheet_name="HSA Expenses", index=False